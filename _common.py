@@ -0,0 +1,119 @@
+"""
+Helpers shared by the Flask app and the Vercel serverless function
+"""
+import binascii
+import math
+import os
+
+import numpy as np
+
+# Shared library name of TFLite's GPU delegate
+GPU_DELEGATE_LIBRARY = 'libtensorflowlite_gpu_delegate.so'
+
+# Probability keys, precomputed once for the JSON response
+PROBABILITY_KEYS = tuple(str(i) for i in range(10))
+
+def format_response(predictions):
+    """Build the prediction response from a (1, 10) probabilities array"""
+    probs = predictions[0].tolist()
+    predicted_digit = max(range(10), key=probs.__getitem__)
+    
+    return {
+        "predicted_digit": predicted_digit,
+        "confidence": probs[predicted_digit],
+        "probabilities": dict(zip(PROBABILITY_KEYS, probs))
+    }
+
+def build_infer(interpreter, input_details, output_details):
+    """Bind the interpreter calls and quantization constants once, so inference is just set/invoke/get"""
+    input_index = input_details['index']
+    input_dtype = input_details['dtype']
+    output_index = output_details['index']
+    set_tensor, invoke, get_tensor = interpreter.set_tensor, interpreter.invoke, interpreter.get_tensor
+    
+    if not np.issubdtype(input_dtype, np.integer):
+        # Float models (fp16 weights) take and return float32 directly
+        def infer(x):
+            set_tensor(input_index, x)
+            invoke()
+            return get_tensor(output_index)
+        
+        return infer
+    
+    input_min, input_max = np.iinfo(input_dtype).min, np.iinfo(input_dtype).max
+    input_scale, input_zero_point = input_details['quantization']
+    inv_input_scale = np.float32(1.0 / input_scale)
+    input_zero_point = np.float32(input_zero_point)
+    
+    output_scale, output_zero_point = output_details['quantization']
+    output_scale = np.float32(output_scale)
+    output_zero_point = np.float32(output_zero_point)
+    
+    # Zero-copy views of the interpreter's own tensor buffers; only held for one statement
+    # at a time, since invoke() refuses to run while a view is alive
+    input_tensor, output_tensor = interpreter.tensor(input_index), interpreter.tensor(output_index)
+    
+    def infer(x):
+        # Quantize input to int8 straight into the input tensor, run, dequantize output to probabilities
+        quantized = np.clip(np.rint(x * inv_input_scale + input_zero_point), input_min, input_max)
+        np.copyto(input_tensor(), quantized, casting='unsafe')
+        invoke()
+        return (output_tensor().astype(np.float32) - output_zero_point) * output_scale
+    
+    return infer
+
+def load_gpu_delegate(load_delegate):
+    """Return the TFLite GPU delegate via the given load_delegate, or None when it is unavailable"""
+    try:
+        return load_delegate(GPU_DELEGATE_LIBRARY)
+    except (ValueError, OSError):
+        return None
+
+def create_interpreter(interpreter_class, load_delegate, model_path, fp16_model_path, batch_size=1, **cpu_options):
+    """Create an interpreter: the fp16 model on the GPU delegate when that works, the int8 model on CPU otherwise
+
+    The input is sized for batch_size once, before tensors are allocated.
+    Returns (interpreter, model_path, accelerator).
+    """
+    if os.path.exists(fp16_model_path):
+        delegate = load_gpu_delegate(load_delegate)
+        if delegate is not None:
+            # The delegate library can load and still fail to apply (e.g. no usable GPU/OpenCL)
+            try:
+                interpreter = interpreter_class(model_path=fp16_model_path, experimental_delegates=[delegate])
+                _allocate(interpreter, batch_size)
+                return interpreter, fp16_model_path, "gpu"
+            except Exception as e:
+                print(f"GPU delegate unusable, falling back to CPU: {e}")
+    
+    interpreter = interpreter_class(model_path=model_path, **cpu_options)
+    _allocate(interpreter, batch_size)
+    return interpreter, model_path, "cpu"
+
+def _allocate(interpreter, batch_size):
+    """Size the input for batch_size (when not 1) and allocate tensors"""
+    if batch_size != 1:
+        interpreter.resize_tensor_input(interpreter.get_input_details()[0]['index'], (batch_size, 28, 28, 1))
+    interpreter.allocate_tensors()
+
+def warm_up_model(infer):
+    """Run one dummy inference so the first request doesn't pay for it"""
+    infer(np.zeros((1, 28, 28, 1), dtype=np.float32))
+
+# The drawing canvas is a few hundred pixels across; anything far larger is not a canvas
+MAX_RAW_IMAGE_SIDE = 1024
+
+def decode_raw_image(image_data):
+    """Decode a base64 square uint8 grayscale buffer (e.g. a 280x280 canvas) without going through PIL"""
+    # Reject oversized payloads before decoding them (base64 is 4 chars per 3 bytes)
+    if len(image_data) > 4 * math.ceil(MAX_RAW_IMAGE_SIDE * MAX_RAW_IMAGE_SIDE / 3):
+        raise ValueError(f"Raw image is larger than {MAX_RAW_IMAGE_SIDE}x{MAX_RAW_IMAGE_SIDE}")
+    
+    # bytearray makes the array writable: the Numba kernel is specialized for (and the
+    # AOT signature only accepts) writable arrays, so a read-only one would be rejected
+    # or trigger a fresh compile
+    buffer = np.frombuffer(bytearray(binascii.a2b_base64(image_data)), dtype=np.uint8)
+    side = math.isqrt(buffer.size)
+    if side * side != buffer.size:
+        raise ValueError(f"Raw image of {buffer.size} bytes is not square")
+    return buffer.reshape(side, side)
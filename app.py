@@ -1,133 +1,279 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
+from whitenoise import WhiteNoise
 import numpy as np
+import orjson
+import xxhash
+from cachetools import LRUCache
 import cv2
 from PIL import Image
 import io
-import base64
+import binascii
 import tensorflow as tf
-from tensorflow.keras.models import load_model
 import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from _common import build_infer, create_interpreter, decode_raw_image, format_response, warm_up_model
+from digit_kernels import center_digit
 
 app = Flask(__name__, static_folder='public')
 CORS(app)
 
-# Global model variable
+# Serve the public folder (index.html at /) from WhiteNoise's in-memory file cache, ahead of Flask routing
+app.wsgi_app = WhiteNoise(app.wsgi_app, root=app.static_folder, prefix='', index_file=True)
+
+# Global model variable (TFLite interpreter) and its tensor details
 model = None
+input_details = None
+output_details = None
+_infer = None
+model_summary = None
+model_paths = None
+
+# The model is baked into the deployment at a fixed path; MODEL_PATH can point at e.g. /opt/model/mnist.tflite
+MODEL_PATH = os.environ.get(
+    'MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'mnist_cnn_model.tflite')
+)
+FP16_MODEL_PATH = os.environ.get(
+    'FP16_MODEL_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models', 'mnist_cnn_model_fp16.tflite')
+)
+load_delegate = tf.lite.experimental.load_delegate
+MODEL_SCRATCH_DIR = '/dev/shm'
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smb3')
+
+def is_on_network_filesystem(path):
+    """Check /proc/mounts for whether path lives on a network filesystem"""
+    try:
+        with open('/proc/mounts') as f:
+            mounts = [line.split()[1:3] for line in f]
+    except OSError:
+        return False
+    
+    # The longest mount point containing the path is the one it lives on
+    path = os.path.realpath(path)
+    best_mount, best_fstype = '', ''
+    for mount_point, fstype in mounts:
+        if path == mount_point or path.startswith(mount_point.rstrip('/') + '/'):
+            if len(mount_point) > len(best_mount):
+                best_mount, best_fstype = mount_point, fstype
+    return best_fstype in NETWORK_FILESYSTEMS
+
+def stage_model_locally(path):
+    """Copy a model file off a network volume once so loading reads local memory; returns the path to load"""
+    if not os.path.exists(path) or not is_on_network_filesystem(path) or not os.path.isdir(MODEL_SCRATCH_DIR):
+        return path
+    
+    local_path = os.path.join(MODEL_SCRATCH_DIR, os.path.basename(path))
+    
+    # Another worker may already have staged this exact file
+    source_stat = os.stat(path)
+    try:
+        local_stat = os.stat(local_path)
+        if local_stat.st_size == source_stat.st_size and local_stat.st_mtime == source_stat.st_mtime:
+            return local_path
+    except OSError:
+        pass
+    
+    # Copy under a per-process name and rename into place, so concurrent workers
+    # never load a partially written file
+    temp_path = f"{local_path}.{os.getpid()}.tmp"
+    shutil.copy2(path, temp_path)
+    os.replace(temp_path, local_path)
+    return local_path
 
 def load_trained_model():
-    """Load the trained CNN model"""
-    global model
-    model_path = "models/mnist_cnn_model.h5"
+    """Load the TFLite CNN model: fp16 on the GPU delegate when available, int8 on CPU otherwise"""
+    global model, input_details, output_details, _infer, model_summary, model_paths
     
-    if os.path.exists(model_path):
-        model = load_model(model_path)
+    if os.path.exists(MODEL_PATH):
+        # Prefer the fp16 model on the GPU delegate, fall back to int8 on CPU
+        model_paths = (stage_model_locally(MODEL_PATH), stage_model_locally(FP16_MODEL_PATH))
+        model, model_path, accelerator = create_interpreter(
+            tf.lite.Interpreter, load_delegate, *model_paths, num_threads=os.cpu_count()
+        )
+        input_details = model.get_input_details()[0]
+        output_details = model.get_output_details()[0]
+        _infer = build_infer(model, input_details, output_details)
+        
+        # Summarize the model once here so /model/info does no per-request work
+        model_summary = {
+            "model_file": os.path.basename(model_path),
+            "model_size_bytes": os.path.getsize(model_path),
+            "accelerator": accelerator,
+            "num_tensors": len(model.get_tensor_details()),
+            "input_shape": input_details['shape'].tolist(),
+            "input_dtype": input_details['dtype'].__name__,
+            "output_shape": output_details['shape'].tolist(),
+            "output_dtype": output_details['dtype'].__name__
+        }
         print(f"Model loaded from {model_path}")
         return True
     else:
-        print(f"Model not found at {model_path}")
+        print(f"Model not found at {MODEL_PATH}")
         return False
 
-def preprocess_image(image_data):
+# TFLite interpreters are not thread-safe; requests served without the batching worker take turns
+_interpreter_lock = threading.Lock()
+
+def run_inference(image):
+    """Run the interpreter on one (1, 28, 28, 1) float32 image and return (1, 10) probabilities"""
+    with _interpreter_lock:
+        return _infer(image)
+
+# Responses for recently seen request bodies, keyed by their xxh64 hash
+RESPONSE_CACHE_SIZE = 256
+_response_cache = LRUCache(maxsize=RESPONSE_CACHE_SIZE)
+_response_cache_lock = threading.Lock()
+
+# Micro-batching: concurrent requests are queued and run through the model together.
+# Each batch is split into power-of-two chunks (11 runs as 8 + 2 + 1), each size with
+# its own interpreter allocated once, so the worker never resizes or re-plans a model
+# and never spends work on padding rows.
+BATCH_SIZES = (1, 2, 4, 8, 16, 32)
+BATCH_MAX_SIZE = BATCH_SIZES[-1]
+BATCH_WINDOW = 0.005  # seconds
+BATCH_RESULT_TIMEOUT = 10  # seconds
+_batch_queue = None
+_batch_runners = None
+
+def _batch_worker():
+    """Collect queued inputs for up to BATCH_WINDOW and predict them as one batch"""
+    while True:
+        items = [_batch_queue.get()]
+        deadline = time.monotonic() + BATCH_WINDOW
+        while len(items) < BATCH_MAX_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(_batch_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        
+        start = 0
+        while start < len(items):
+            # Largest chunk size that fits in what is left
+            chunk_size = next(size for size in reversed(BATCH_SIZES) if size <= len(items) - start)
+            chunk = items[start:start + chunk_size]
+            start += chunk_size
+            
+            try:
+                if chunk_size == 1:
+                    predictions = run_inference(chunk[0][0])
+                else:
+                    batch, infer = _batch_runners[chunk_size]
+                    for i, (image, _) in enumerate(chunk):
+                        batch[i] = image[0]
+                    predictions = infer(batch)
+            except Exception as e:
+                for _, future in chunk:
+                    future.set_exception(e)
+                continue
+            
+            for i, (_, future) in enumerate(chunk):
+                future.set_result(predictions[i:i+1])
+
+def start_batching():
+    """Start the micro-batching worker; only useful when requests are served by multiple threads"""
+    global _batch_queue, _batch_runners
+    if _batch_queue is None:
+        # Single images go through the already warmed import-time model
+        _batch_runners = {}
+        for size in BATCH_SIZES[1:]:
+            interpreter, _, _ = create_interpreter(
+                tf.lite.Interpreter, load_delegate, *model_paths, batch_size=size, num_threads=os.cpu_count()
+            )
+            infer = build_infer(interpreter, interpreter.get_input_details()[0], interpreter.get_output_details()[0])
+            batch = np.zeros((size, 28, 28, 1), dtype=np.float32)
+            
+            # Pay the first-invoke cost now rather than on the first batch of this size
+            infer(batch)
+            _batch_runners[size] = (batch, infer)
+        
+        _batch_queue = queue.Queue()
+        threading.Thread(target=_batch_worker, daemon=True).start()
+
+# Load and warm the model at import time so Flask workers start ready
+if load_trained_model():
+    warm_up_model(_infer)
+else:
+    print("Warning: Model not loaded. Train and save a model first.")
+
+# Per-thread model input buffer, since the Flask server handles requests concurrently
+_thread_local = threading.local()
+INV_255 = np.float32(1.0 / 255.0)
+
+def get_input_buffer():
+    """Return this thread's preallocated (1, 28, 28, 1) float32 input buffer"""
+    buffer = getattr(_thread_local, 'input_buffer', None)
+    if buffer is None:
+        buffer = _thread_local.input_buffer = np.empty((1, 28, 28, 1), dtype=np.float32)
+    return buffer
+
+# Pixels brighter than this count as part of the digit
+DIGIT_THRESHOLD = np.uint8(50)
+
+# Prefer the ahead-of-time compiled kernel (python build_ext.py); fall back to Numba JIT
+try:
+    from mnist_native import center_digit as _center_digit
+except ImportError:
+    from numba import njit
+    _center_digit = njit(cache=True, fastmath=True)(center_digit)
+    
+    # Compile (or load from cache) now rather than on the first request
+    _center_digit(np.zeros((28, 28), dtype=np.uint8), DIGIT_THRESHOLD)
+
+def preprocess_image(image_data, raw=False):
     """Preprocess uploaded image for prediction with improved accuracy"""
     try:
+        if raw:
+            # Raw canvas pixels skip PIL entirely
+            img_array = decode_raw_image(image_data)
+        
         # Convert base64 to PIL Image if needed
-        if isinstance(image_data, str):
+        elif isinstance(image_data, str):
             # Remove data URL prefix if present
-            if image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
+            if image_data.startswith('data:'):
+                image_data = image_data[image_data.index(',')+1:]
             
             # Decode base64
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
+            image_bytes = binascii.a2b_base64(image_data)
+            img_array = np.array(Image.open(io.BytesIO(image_bytes)).convert('L'))
         else:
-            image = Image.open(image_data)
-        
-        # Convert to grayscale
-        image = image.convert('L')
-        
-        # Convert to numpy array for processing
-        img_array = np.array(image)
+            img_array = np.array(Image.open(image_data).convert('L'))
         
         # For canvas drawings: white strokes on black background
         # Check if we need to invert (if background is brighter than strokes)
         if np.mean(img_array) > 127:
             img_array = 255 - img_array
         
-        # Find bounding box of the digit to center it properly
-        # This is crucial for MNIST accuracy
-        rows = np.any(img_array > 50, axis=1)
-        cols = np.any(img_array > 50, axis=0)
-        
-        if rows.any() and cols.any():
-            rmin, rmax = np.where(rows)[0][[0, -1]]
-            cmin, cmax = np.where(cols)[0][[0, -1]]
-            
-            # Extract the digit with some padding
-            digit = img_array[rmin:rmax+1, cmin:cmax+1]
-            
-            # Create a square image with the digit centered
-            size = max(digit.shape[0], digit.shape[1])
-            # Add 20% padding
-            size = int(size * 1.2)
-            
-            # Create black square
-            square = np.zeros((size, size), dtype=np.uint8)
-            
-            # Center the digit in the square
-            y_offset = (size - digit.shape[0]) // 2
-            x_offset = (size - digit.shape[1]) // 2
-            square[y_offset:y_offset+digit.shape[0], x_offset:x_offset+digit.shape[1]] = digit
-            
-            # Convert back to PIL for resizing
-            image = Image.fromarray(square)
-        
-        # Resize to 28x28 with high-quality resampling
-        image = image.resize((28, 28), Image.Resampling.LANCZOS)
+        # Center the digit in a padded square - this is crucial for MNIST accuracy
+        square = _center_digit(img_array, DIGIT_THRESHOLD)
         
-        # Convert back to numpy array
-        img_array = np.array(image)
+        # Resize to 28x28 - INTER_AREA is the appropriate kernel for downsampling
+        img_array = cv2.resize(square, (28, 28), interpolation=cv2.INTER_AREA)
         
-        # Normalize to 0-1 range
-        img_array = img_array.astype(np.float32) / 255.0
+        # Normalize to 0-1 range straight into the model input buffer
+        input_buffer = get_input_buffer()
+        np.multiply(img_array.reshape(1, 28, 28, 1), INV_255, out=input_buffer)
+        img_array = input_buffer[0, :, :, 0]
         
-        # Apply minimal smoothing only if needed (reduce noise without losing detail)
-        try:
-            from scipy import ndimage
-            # Very light smoothing to reduce pixelation
-            img_array = ndimage.gaussian_filter(img_array, sigma=0.3)
-        except ImportError:
-            pass
+        # Very light smoothing to reduce pixelation (in place, no detail lost)
+        # The kernel is normalized and non-negative, so values stay within 0-1
+        cv2.GaussianBlur(img_array, (3, 3), 0.3, dst=img_array)
         
-        # Ensure values are in valid range
-        img_array = np.clip(img_array, 0, 1)
-        
-        # Reshape for model input (1, 28, 28, 1)
-        img_array = img_array.reshape(1, 28, 28, 1)
-        
-        return img_array
+        return input_buffer
         
     except Exception as e:
         print(f"Error preprocessing image: {str(e)}")
-        import traceback
         traceback.print_exc()
         return None
 
-@app.route('/')
-def home():
-    """Serve the main HTML interface"""
-    return send_from_directory(app.static_folder, 'index.html')
-
-@app.route('/script.js')
-def serve_script():
-    """Serve the JavaScript file"""
-    return send_from_directory(app.static_folder, 'script.js')
-
-@app.route('/<path:filename>')
-def serve_static(filename):
-    """Serve static files from public folder"""
-    return send_from_directory(app.static_folder, filename)
-
 @app.route('/debug')
 def debug():
     """Serve debug test page"""
@@ -150,9 +296,20 @@ def predict():
         return jsonify({"error": "Model not loaded"}), 500
     
     try:
+        # Identical JSON requests (e.g. a double-click on the same drawing) skip the model entirely.
+        # Multipart uploads are not hashed: their boundaries are random, so they never repeat,
+        # and reading the body here would buffer the whole upload in memory.
+        body_hash = None
+        if request.is_json:
+            body_hash = xxhash.xxh64(request.get_data()).intdigest()
+            with _response_cache_lock:
+                cached_response = _response_cache.get(body_hash)
+            if cached_response is not None:
+                return Response(cached_response, mimetype='application/json')
+        
         # Get image from request
-        request_json = request.get_json()
-        if 'image' not in request.files and (not request_json or 'image_data' not in request_json):
+        request_json = request.get_json(silent=True)
+        if 'image' not in request.files and (not request_json or ('image_data' not in request_json and 'image_raw' not in request_json)):
             return jsonify({"error": "No image provided"}), 400
         
         # Handle file upload
@@ -161,8 +318,12 @@ def predict():
             if image_file.filename == '':
                 return jsonify({"error": "No image selected"}), 400
             
-            # Preprocess image
-            processed_image = preprocess_image(image_file)
+            # Preprocess image, decoding straight from the upload stream
+            processed_image = preprocess_image(image_file.stream)
+        
+        # Handle raw grayscale canvas buffer
+        elif 'image_raw' in request_json:
+            processed_image = preprocess_image(request_json['image_raw'], raw=True)
         
         # Handle base64 image data
         elif request_json and 'image_data' in request_json:
@@ -172,22 +333,19 @@ def predict():
         if processed_image is None:
             return jsonify({"error": "Failed to process image"}), 400
         
-        # Make prediction
-        predictions = model.predict(processed_image, verbose=0)
-        predicted_digit = int(np.argmax(predictions[0]))
-        confidence = float(np.max(predictions[0]))
-        
-        # Get all probabilities
-        probabilities = {
-            str(i): float(predictions[0][i]) 
-            for i in range(10)
-        }
+        # Make prediction, batched with other in-flight requests when enabled
+        if _batch_queue is not None:
+            future = Future()
+            _batch_queue.put((processed_image, future))
+            predictions = future.result(timeout=BATCH_RESULT_TIMEOUT)
+        else:
+            predictions = run_inference(processed_image)
         
-        return jsonify({
-            "predicted_digit": predicted_digit,
-            "confidence": confidence,
-            "probabilities": probabilities
-        })
+        body = orjson.dumps(format_response(predictions))
+        if body_hash is not None:
+            with _response_cache_lock:
+                _response_cache[body_hash] = body
+        return Response(body, mimetype='application/json')
         
     except Exception as e:
         return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
@@ -195,23 +353,13 @@ def predict():
 @app.route('/model/info')
 def model_info():
     """Get model information"""
-    global model
-    
     if model is None:
         return jsonify({"error": "Model not loaded"}), 500
     
-    try:
-        return jsonify({
-            "model_summary": str(model.summary()),
-            "input_shape": model.input_shape,
-            "output_shape": model.output_shape
-        })
-    except Exception as e:
-        return jsonify({"error": f"Failed to get model info: {str(e)}"}), 500
+    return jsonify(model_summary)
 
 if __name__ == '__main__':
-    # Load model on startup
-    if not load_trained_model():
-        print("Warning: Model not loaded. Train and save a model first.")
+    if model is not None:
+        start_batching()
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
\ No newline at end of file
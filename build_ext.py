@@ -0,0 +1,14 @@
+"""
+Compile the digit preprocessing kernels ahead of time into the mnist_native
+extension, so the server never pays for Numba JIT compilation at startup
+"""
+from numba.pycc import CC
+
+from digit_kernels import center_digit
+
+cc = CC('mnist_native')
+cc.export('center_digit', 'uint8[:,:](uint8[:,:], uint8)')(center_digit)
+
+if __name__ == '__main__':
+    cc.compile()
+    print(f"Built mnist_native in {cc.output_dir}")
@@ -0,0 +1,65 @@
+"""
+Convert the trained Keras model to TFLite: full-integer (int8) for CPU
+and float16 weights for the GPU delegate
+"""
+import contextlib
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+KERAS_MODEL_PATH = "models/mnist_cnn_model.h5"
+TFLITE_MODEL_PATH = "models/mnist_cnn_model.tflite"
+TFLITE_FP16_MODEL_PATH = "models/mnist_cnn_model_fp16.tflite"
+
+def representative_dataset():
+    """Yield ~100 MNIST training images to calibrate the int8 ranges"""
+    (x_train, _), _ = tf.keras.datasets.mnist.load_data()
+    images = x_train[:100].astype(np.float32) / 255.0
+    for image in images:
+        yield [image.reshape(1, 28, 28, 1)]
+
+@contextlib.contextmanager
+def make_converter(model):
+    """Build a converter from a SavedModel export of the Keras model
+
+    TFLiteConverter.from_keras_model fails on Keras 3 models loaded from .h5
+    (the bias variables are not frozen), so go through model.export() instead.
+    The exported signature keeps a dynamic batch dimension. The export is
+    removed on exit, so convert() must run inside the with block.
+    """
+    with tempfile.TemporaryDirectory() as export_dir:
+        model.export(export_dir)
+        yield tf.lite.TFLiteConverter.from_saved_model(export_dir)
+
+def convert_int8(model):
+    """Run post-training full-integer quantization and save the result"""
+    with make_converter(model) as converter:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+        tflite_model = converter.convert()
+
+    with open(TFLITE_MODEL_PATH, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"Saved int8 model to {TFLITE_MODEL_PATH} ({len(tflite_model)} bytes)")
+
+def convert_fp16(model):
+    """Store the weights as float16 and save the result"""
+    with make_converter(model) as converter:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+        tflite_model = converter.convert()
+
+    with open(TFLITE_FP16_MODEL_PATH, 'wb') as f:
+        f.write(tflite_model)
+
+    print(f"Saved fp16 model to {TFLITE_FP16_MODEL_PATH} ({len(tflite_model)} bytes)")
+
+if __name__ == '__main__':
+    model = tf.keras.models.load_model(KERAS_MODEL_PATH)
+    convert_int8(model)
+    convert_fp16(model)
@@ -0,0 +1,38 @@
+"""
+Numeric kernels for digit preprocessing, written in the Numba-compatible
+subset of Python so they can be JIT-compiled or compiled ahead of time
+"""
+import numpy as np
+
+def center_digit(img, thresh):
+    """Crop the digit's bounding box and center it in a square with 20% padding"""
+    h, w = img.shape
+    rmin, rmax, cmin, cmax = h, -1, w, -1
+    
+    # Single pass to find the bounding box
+    for i in range(h):
+        for j in range(w):
+            if img[i, j] > thresh:
+                if i < rmin:
+                    rmin = i
+                if i > rmax:
+                    rmax = i
+                if j < cmin:
+                    cmin = j
+                if j > cmax:
+                    cmax = j
+    
+    # Nothing drawn, leave the image as-is
+    if rmax < 0:
+        return img
+    
+    digit_h = rmax - rmin + 1
+    digit_w = cmax - cmin + 1
+    size = int(max(digit_h, digit_w) * 1.2)
+    
+    # Blit the digit into the middle of a black square
+    out = np.zeros((size, size), np.uint8)
+    y = (size - digit_h) // 2
+    x = (size - digit_w) // 2
+    out[y:y+digit_h, x:x+digit_w] = img[rmin:rmax+1, cmin:cmax+1]
+    return out